@@ -0,0 +1,228 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from openai import AsyncAzureOpenAI
+
+from caching import Broadcast, SingleFlight, TTLCache
+from telemetry import record_token_usage
+from upstream import ADVICE_STAGE, UpstreamError, call_with_retries
+
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "https://chat-with-db.openai.azure.com/")
+AZURE_OPENAI_API_VERSION = "2024-12-01-preview"
+ADVICE_MODEL = "gpt-4.1"
+ADVICE_CACHE_PATH = os.getenv("ADVICE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "advice_cache.db"))
+ADVICE_TTL_SECONDS = float(os.getenv("ADVICE_TTL_SECONDS", str(24 * 3600)))
+ADVICE_CACHE_SIZE = int(os.getenv("ADVICE_CACHE_SIZE", "10000"))
+ADVICE_LOCAL_CACHE_SIZE = int(os.getenv("ADVICE_LOCAL_CACHE_SIZE", "1024"))
+
+
+def advice_key(crop_name, risk_types, region):
+    return f"{crop_name.strip().lower()}|{','.join(sorted(risk_types))}|{region.strip().lower()}"
+
+
+def advice_prompt(crop_name, risk_types, region):
+    risks = ", ".join(sorted(risk_types))
+    return (
+        f"Given region {region} and crop {crop_name}, what should a farmer do this week "
+        f"given forecast risks of {risks}?"
+    )
+
+
+class AdviceStore:
+    """SQLite-backed advice cache shared by every gunicorn worker on the host.
+
+    Entries expire after their TTL; once the table holds more than ``maxsize``
+    rows the least recently used ones are evicted. Reads never write: hits are
+    noted in memory and their ``last_used`` is flushed with the next ``put``.
+    Methods block on SQLite, so async callers run them in a worker thread.
+    """
+
+    def __init__(self, path=ADVICE_CACHE_PATH, maxsize=ADVICE_CACHE_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS advice ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, expires_at FROM advice WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                self._touched[key] = now
+        return row
+
+    def put(self, key, content, ttl):
+        now = time.time()
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._conn.executemany(
+                "UPDATE advice SET last_used = ? WHERE key = ?", [(used, k) for k, used in touched.items()]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO advice (key, content, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, content, now + ttl, now),
+            )
+            self._conn.execute("DELETE FROM advice WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM advice WHERE key NOT IN (SELECT key FROM advice ORDER BY last_used DESC LIMIT ?)",
+                (self.maxsize,),
+            )
+            self._conn.commit()
+
+
+def create_openai_client(api_key):
+    # Retries are driven by ADVICE_STAGE, so the SDK's own are disabled.
+    return AsyncAzureOpenAI(
+        api_version=AZURE_OPENAI_API_VERSION,
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_key=api_key,
+        max_retries=0,
+    )
+
+
+class AdviceService:
+    """Crop advice from Azure OpenAI, cached on (crop, risk types, region).
+
+    Lookups go through an in-process TTL/LRU cache, then the shared
+    AdviceStore; only a miss in both reaches the model, and concurrent misses
+    for the same key share a single completion, streamed or not.
+    """
+
+    def __init__(self, client, store=None, ttl=ADVICE_TTL_SECONDS, local_cache_size=ADVICE_LOCAL_CACHE_SIZE):
+        self.client = client
+        self.store = store
+        self.ttl = ttl
+        self.cache = TTLCache(maxsize=local_cache_size, ttl=ttl)
+        self._flight = SingleFlight()
+        self._feeds = {}
+
+    async def get(self, crop_name, risk_types, region):
+        key = advice_key(crop_name, risk_types, region)
+        content = self.cache.get(key)
+        if content is not None:
+            return content
+        return await self._flight.do(key, lambda: self._load(key, crop_name, risk_types, region))
+
+    async def _load(self, key, crop_name, risk_types, region):
+        content = await self._cached(key, record_stats=False)
+        if content is not None:
+            return content
+
+        content = await call_with_retries(ADVICE_STAGE, lambda: self._complete(crop_name, risk_types, region))
+        await self._remember(key, content)
+        return content
+
+    async def stream(self, crop_name, risk_types, region):
+        """Yields the advice in pieces as the model produces them.
+
+        A cached answer is yielded whole. Otherwise one streamed completion per
+        key is shared: concurrent callers replay its parts as they arrive, and
+        a caller that finds a non-streamed ``get`` in flight yields its answer
+        whole. Like ``get``, the completion runs to the end and is cached even
+        if every caller goes away. Only opening the stream is retried, and each
+        chunk must arrive within the stage timeout.
+        """
+        key = advice_key(crop_name, risk_types, region)
+        content = await self._cached(key)
+        if content is not None:
+            yield content
+            return
+
+        task = self._flight.get(key)
+        if task is None:
+            self._feeds[key] = Broadcast()
+            task = self._flight.start(key, lambda: self._load_stream(key, crop_name, risk_types, region))
+        feed = self._feeds.get(key)
+        if feed is None:
+            content = await asyncio.shield(task)
+            if content:
+                yield content
+            return
+
+        async for part in feed.follow():
+            yield part
+        await asyncio.shield(task)  # raises the completion's error, if any
+
+    async def _load_stream(self, key, crop_name, risk_types, region):
+        feed = self._feeds[key]
+        try:
+            content = await self._cached(key, record_stats=False)
+            if content is not None:
+                feed.append(content)
+                return content
+
+            stream = await call_with_retries(
+                ADVICE_STAGE, lambda: self._complete(crop_name, risk_types, region, stream=True))
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout=ADVICE_STAGE.timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError as e:
+                        raise UpstreamError(ADVICE_STAGE.name, e) from e
+                    record_token_usage(chunk.usage)
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        feed.append(delta)
+            finally:
+                await stream.close()
+            content = "".join(feed.parts)
+            if content:
+                await self._remember(key, content)
+            return content
+        finally:
+            self._feeds.pop(key, None)
+            feed.close()
+
+    async def _cached(self, key, record_stats=True):
+        content = self.cache.get(key, record_stats=record_stats)
+        if content is not None or self.store is None:
+            return content
+        row = await asyncio.to_thread(self.store.get, key)
+        if row is None:
+            return None
+        content, expires_at = row
+        self.cache.set(key, content, ttl=expires_at - time.time())
+        return content
+
+    async def _remember(self, key, content):
+        self.cache.set(key, content)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put, key, content, self.ttl)
+
+    async def _complete(self, crop_name, risk_types, region, stream=False):
+        response = await self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": "You are a farmer and weather assistant."},
+                {"role": "user", "content": advice_prompt(crop_name, risk_types, region)},
+            ],
+            max_completion_tokens=800,
+            temperature=1.0,
+            top_p=1.0,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+            model=ADVICE_MODEL,
+            stream=stream,
+            # Streamed completions only report token usage when asked to
+            **({"stream_options": {"include_usage": True}} if stream else {}),
+        )
+        if stream:
+            return response
+        record_token_usage(response.usage)
+        return response.choices[0].message.content
+
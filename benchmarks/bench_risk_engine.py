@@ -0,0 +1,103 @@
+"""Microbenchmark: vectorized RiskEngine vs. the original per-day rule loop.
+
+    python benchmarks/bench_risk_engine.py [--locations 2000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from risk_engine import CROP_RISK_PROFILES, RiskEngine, describe, stack_features  # noqa: E402
+
+
+def legacy_assess(profile, forecast_days):
+    # The rule loop /analyze used before RiskEngine, kept verbatim for comparison.
+    detected_risks = []
+    for day in forecast_days:
+        date, weather = day["date"], day["day"]
+        rain, temp_max, temp_min = weather.get("totalprecip_mm", 0), weather.get("maxtemp_c", 0), weather.get("mintemp_c", 0)
+        wind, humidity = weather.get("maxwind_kph", 0), weather.get("avghumidity", 0)
+
+        if rain < profile["min_rain_mm"]:
+            detected_risks.append(f"Drought risk on {date}")
+        if rain > 80:
+            detected_risks.append(f"Flood risk on {date}")
+        if temp_max > profile["max_temp_c"]:
+            detected_risks.append(f"Heat stress on {date}")
+        if temp_min < profile["min_temp_c"]:
+            detected_risks.append(f"Cold/frost risk on {date}")
+        if wind > profile["max_wind_kmph"]:
+            detected_risks.append(f"Wind damage risk on {date}")
+        if humidity > profile["max_humidity"] and temp_max > 30:
+            detected_risks.append(f"Pest/disease risk on {date}")
+    return detected_risks
+
+
+def synthetic_forecasts(locations, days=7, seed=0):
+    rng = np.random.default_rng(seed)
+    forecasts = []
+    for _ in range(locations):
+        forecasts.append([
+            {
+                "date": f"2025-06-{d + 1:02d}",
+                "day": {
+                    "totalprecip_mm": float(rng.gamma(0.8, 12.0)),
+                    "maxtemp_c": float(rng.uniform(24, 44)),
+                    "mintemp_c": float(rng.uniform(8, 28)),
+                    "maxwind_kph": float(rng.uniform(5, 60)),
+                    "avghumidity": float(rng.uniform(40, 100)),
+                },
+            }
+            for d in range(days)
+        ])
+    return forecasts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locations", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = RiskEngine(CROP_RISK_PROFILES)
+    forecasts = synthetic_forecasts(args.locations)
+
+    def loop():
+        return [[legacy_assess(profile, days) for profile in CROP_RISK_PROFILES.values()] for days in forecasts]
+
+    def vectorized():
+        return engine.evaluate(stack_features(forecasts))
+
+    # Both must flag the same risks on the same days before their timings mean anything
+    hits = vectorized()
+    for location, (days, per_crop) in enumerate(zip(forecasts, loop())):
+        dates = [day["date"] for day in days]
+        for crop, legacy in zip(CROP_RISK_PROFILES, per_crop):
+            messages, _ = describe(hits[location, engine.crop_index(crop)], dates)
+            assert sorted(messages) == sorted(legacy), (location, crop, messages, legacy)
+
+    def best(fn, number):
+        return min(timeit.repeat(fn, number=number, repeat=args.repeat)) / number
+
+    single = forecasts[:1]
+    single_loop = best(lambda: [legacy_assess(p, single[0]) for p in CROP_RISK_PROFILES.values()], 2000)
+    single_vec = best(lambda: engine.evaluate(stack_features(single)), 2000)
+    batch_loop = best(loop, 1)
+    batch_vec = best(vectorized, 1)
+    features = stack_features(forecasts)
+    batch_eval = best(lambda: engine.evaluate(features), 10)
+
+    crops = len(engine.crops)
+    print(f"crops={crops} days=7 risk types=6 locations={args.locations}")
+    print(f"{'case':<32}{'loop':>12}{'vectorized':>14}{'speedup':>10}")
+    print(f"{'1 location x all crops':<32}{single_loop * 1e6:>10.1f}us{single_vec * 1e6:>12.1f}us{single_loop / single_vec:>9.1f}x")
+    print(f"{f'{args.locations} locations x all crops':<32}{batch_loop * 1e3:>10.1f}ms{batch_vec * 1e3:>12.1f}ms{batch_loop / batch_vec:>9.1f}x")
+    print(f"{'  (rule evaluation only)':<32}{'':>12}{batch_eval * 1e3:>12.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe, size-bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None, record_stats=True):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += record_stats
+                return default
+            self._data.move_to_end(key)
+            self.hits += record_stats
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries also expire ``ttl`` seconds after being set."""
+
+    def __init__(self, maxsize=1024, ttl=600, timer=time.monotonic):
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+        self._timer = timer
+
+    def get(self, key, default=None, record_stats=True):
+        entry = super().get(key, record_stats=record_stats)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= self._timer():
+            with self._lock:
+                # Only drop the entry if nobody refreshed it in the meantime.
+                if self._data.get(key) is entry:
+                    del self._data[key]
+                self.hits -= record_stats
+                self.misses += record_stats
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        super().set(key, (self._timer() + (self.ttl if ttl is None else ttl), value))
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single execution.
+
+    The first caller for a key starts ``fn()`` as a task; callers arriving
+    while it is in flight await the same task. The task is shielded, so a
+    cancelled caller does not cancel the work for the others. Not thread-safe:
+    use one instance per event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def get(self, key):
+        """The task in flight for ``key``, or None."""
+        return self._calls.get(key)
+
+    def start(self, key, fn):
+        """Returns the task in flight for ``key``, starting ``fn()`` if there is none."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return task
+
+    async def do(self, key, fn):
+        return await asyncio.shield(self.start(key, fn))
+
+
+class Broadcast:
+    """Append-only parts that any number of readers replay from the start as they arrive.
+
+    Not thread-safe: use one instance per event loop.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def append(self, part):
+        self.parts.append(part)
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        sent = 0
+        while True:
+            while sent < len(self.parts):
+                yield self.parts[sent]
+                sent += 1
+            if self.closed:
+                return
+            await self._changed.wait()
@@ -0,0 +1,51 @@
+import os
+
+from caching import SingleFlight, TTLCache
+from upstream import FORECAST_STAGE, call_with_retries, get_json
+
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.weatherapi.com/v1/forecast.json")
+FORECAST_DAYS = 7
+FORECAST_GRID_DEG = float(os.getenv("FORECAST_GRID_DEG", "0.1"))
+FORECAST_TTL_SECONDS = float(os.getenv("FORECAST_TTL_SECONDS", "3600"))
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "2048"))
+
+
+def grid_cell(lat, lon, grid=FORECAST_GRID_DEG):
+    """Snaps a coordinate to the centre-point of its ``grid``-degree cell."""
+    return round(round(float(lat) / grid) * grid, 6), round(round(float(lon) / grid) * grid, 6)
+
+
+class ForecastCache:
+    """7-day WeatherAPI forecasts cached per grid cell.
+
+    Nearby coordinates share a cell, so they share one cached forecast, and
+    concurrent misses for a cell are coalesced into a single upstream call.
+    """
+
+    def __init__(self, http, api_key, grid=FORECAST_GRID_DEG, ttl=FORECAST_TTL_SECONDS, maxsize=FORECAST_CACHE_SIZE):
+        self.http = http
+        self.api_key = api_key
+        self.grid = grid
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+
+    async def get(self, lat, lon):
+        cell = grid_cell(lat, lon, self.grid)
+        forecast = self.cache.get(cell)
+        if forecast is not None:
+            return forecast
+        return await self._flight.do(cell, lambda: self._load(cell))
+
+    async def _load(self, cell):
+        # Another flight may have filled the cell between our miss and now.
+        forecast = self.cache.get(cell, record_stats=False)
+        if forecast is not None:
+            return forecast
+
+        lat, lon = cell
+        forecast = await call_with_retries(FORECAST_STAGE, lambda: get_json(
+            self.http, WEATHER_API_URL, params={"key": self.api_key, "q": f"{lat},{lon}", "days": FORECAST_DAYS}
+        ))
+        if forecast.get("forecast", {}).get("forecastday"):
+            self.cache.set(cell, forecast)
+        return forecast
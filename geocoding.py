@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import csv
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from caching import LRUCache, SingleFlight, TTLCache
+from upstream import GEOCODE_STAGE, RateLimiter, call_with_retries, get_json
+
+PIN_INDEX_PATH = os.getenv("PIN_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pincodes.db"))
+PIN_CACHE_SIZE = int(os.getenv("PIN_CACHE_SIZE", "4096"))
+PIN_NOT_FOUND_TTL_SECONDS = float(os.getenv("PIN_NOT_FOUND_TTL_SECONDS", str(24 * 3600)))
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+# Nominatim's usage policy allows at most 1 request/s; the limit is shared by
+# every worker on the host through the PIN index file
+NOMINATIM_MAX_RPS = float(os.getenv("NOMINATIM_MAX_RPS", "1"))
+NOMINATIM_MAX_WAIT_SECONDS = float(os.getenv("NOMINATIM_MAX_WAIT_SECONDS", "30"))
+PIN_CODE_PATTERN = re.compile(r"[1-9][0-9]{5}")
+
+
+class PinIndex:
+    """On-disk PIN code -> (lat, lon) index backed by SQLite.
+
+    The index is shared by every gunicorn worker on the host; WAL mode lets
+    readers proceed while a worker writes back a Nominatim result. The same
+    file holds the host-wide rate-limit slots used by HostRateLimiter.
+    """
+
+    def __init__(self, path=PIN_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pincodes ("
+            "pin_code TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL, source TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits (name TEXT PRIMARY KEY, next_slot REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def get(self, pin_code):
+        with self._lock:
+            row = self._conn.execute("SELECT lat, lon FROM pincodes WHERE pin_code = ?", (pin_code,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, pin_code, lat, lon, source="nominatim"):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pincodes (pin_code, lat, lon, source) VALUES (?, ?, ?, ?)",
+                (pin_code, lat, lon, source),
+            )
+            self._conn.commit()
+
+    def reserve_slot(self, name, interval, max_wait):
+        """Reserves the next free ``name`` slot for this host; returns seconds to wait, or None."""
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers
+            # cannot read the same next_slot
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT next_slot FROM rate_limits WHERE name = ?", (name,)).fetchone()
+                slot = max(now, row[0] if row else 0.0)
+                if slot - now > max_wait:
+                    return None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (name, next_slot) VALUES (?, ?)", (name, slot + interval)
+                )
+                self._conn.commit()
+                return slot - now
+            finally:
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+
+    def bulk_load(self, csv_path, pin_column="pincode", lat_column="latitude", lon_column="longitude"):
+        # The India Post directory lists one row per post office, so a PIN can
+        # appear many times; store the centroid of its offices.
+        sums = {}
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                pin_code = (row.get(pin_column) or "").strip()
+                try:
+                    lat, lon = float(row[lat_column]), float(row[lon_column])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not pin_code:
+                    continue
+                total = sums.setdefault(pin_code, [0.0, 0.0, 0])
+                total[0] += lat
+                total[1] += lon
+                total[2] += 1
+
+        rows = [(pin, lat / n, lon / n, "csv") for pin, (lat, lon, n) in sums.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pincodes (pin_code, lat, lon, source) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pincodes").fetchone()[0]
+
+
+class HostRateLimiter(RateLimiter):
+    """RateLimiter whose slots live in the PIN index, so all workers on the host share one budget."""
+
+    def __init__(self, index, name, rate, max_wait):
+        super().__init__(rate, max_wait)
+        self.index = index
+        self.name = name
+
+    async def _reserve(self):
+        return await asyncio.to_thread(self.index.reserve_slot, self.name, self.interval, self.max_wait)
+
+
+class Geocoder:
+    """Resolves PIN codes via an in-process LRU, then the index, then Nominatim.
+
+    Nominatim calls are rate limited, and PINs it could not find are remembered
+    for PIN_NOT_FOUND_TTL_SECONDS so repeated bad PINs never reach it again.
+    Index reads and writes run in a worker thread, and concurrent misses for
+    the same PIN share one index lookup, Nominatim call and write-back.
+    """
+
+    def __init__(self, index, http, cache_size=PIN_CACHE_SIZE, not_found_ttl=PIN_NOT_FOUND_TTL_SECONDS,
+                 limiter=None):
+        self.index = index
+        self.http = http
+        self.cache = LRUCache(maxsize=cache_size)
+        self.not_found = TTLCache(maxsize=cache_size, ttl=not_found_ttl)
+        self.limiter = limiter or HostRateLimiter(index, "nominatim", NOMINATIM_MAX_RPS, NOMINATIM_MAX_WAIT_SECONDS)
+        self._flight = SingleFlight()
+
+    async def lookup(self, pin_code):
+        pin_code = pin_code.strip()
+        if not PIN_CODE_PATTERN.fullmatch(pin_code):
+            return None
+        location = self.cache.get(pin_code)
+        if location is not None:
+            return location
+        if self.not_found.get(pin_code) is not None:
+            return None
+
+        location = await self._flight.do(pin_code, lambda: self._load(pin_code))
+        if location is not None:
+            self.cache.set(pin_code, location)
+        return location
+
+    async def _load(self, pin_code):
+        location = await asyncio.to_thread(self.index.get, pin_code)
+        if location is not None:
+            return location
+        location = await self._lookup_nominatim(pin_code)
+        if location is not None:
+            await asyncio.to_thread(self.index.put, pin_code, *location)
+        return location
+
+    async def _lookup_nominatim(self, pin_code):
+        geo_response = await call_with_retries(GEOCODE_STAGE, lambda: get_json(
+            self.http,
+            NOMINATIM_URL,
+            params={"postalcode": pin_code, "country": "India", "format": "json"},
+            headers={"User-Agent": "FarmerCopilotApp/1.0"},
+        ), limiter=self.limiter)
+        if not geo_response:
+            self.not_found.set(pin_code, True)
+            return None
+        return float(geo_response[0]["lat"]), float(geo_response[0]["lon"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local PIN code geocoding index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    load = subparsers.add_parser("load", help="Bulk-load PIN codes from a CSV file.")
+    load.add_argument("csv_path")
+    load.add_argument("--index", default=PIN_INDEX_PATH)
+    load.add_argument("--pin-column", default="pincode")
+    load.add_argument("--lat-column", default="latitude")
+    load.add_argument("--lon-column", default="longitude")
+    args = parser.parse_args()
+
+    index = PinIndex(args.index)
+    count = index.bulk_load(args.csv_path, args.pin_column, args.lat_column, args.lon_column)
+    print(f"Loaded {count} PIN codes into {args.index} ({len(index)} total)")
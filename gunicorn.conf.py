@@ -0,0 +1,15 @@
+# gunicorn -c gunicorn.conf.py main:app
+import os
+
+from secret_provider import default_provider
+
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_secrets = os.getenv("SECRETS_PRELOAD", "1") == "1"
+
+
+def on_starting(server):
+    # Fetch secrets once in the master; forked workers inherit them through
+    # SECRET_* environment variables instead of each calling Key Vault.
+    if preload_secrets:
+        default_provider().export_env()
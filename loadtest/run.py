@@ -0,0 +1,197 @@
+"""Offline load test: stub upstreams, the app under uvicorn or gunicorn, and a replay driver.
+
+    python loadtest/run.py --server gunicorn --workers 4 --concurrency 64 --requests 5000
+    python loadtest/run.py --workload workload.jsonl --duration 60 --stub-arg=--latency --stub-arg=azure-openai=5000
+
+The app runs with local secrets, and every upstream points at loadtest/stubs.py,
+so no Azure, Nominatim or WeatherAPI access is needed. The report shows
+throughput and p50/p95/p99 latency per endpoint. For streaming endpoints it
+also shows time to first byte.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from workload import generate  # noqa: E402
+
+
+def app_env(stub_url, workdir):
+    return {
+        **os.environ,
+        "SECRETS_SOURCE": "local",
+        "SECRETS_PRELOAD": "0",
+        "SECRETS_REFRESH_SECONDS": "0",
+        "SECRET_OPENWEATHERAPIKEY": "stub",
+        "SECRET_OPENSUBSCRIPTIONKEY": "stub",
+        "SECRET_APPLICATIONINSIGHTSCONNECTIONSTRING": (
+            f"InstrumentationKey=00000000-0000-0000-0000-000000000000;IngestionEndpoint={stub_url}/appinsights/"
+        ),
+        "APPLICATIONINSIGHTS_STATSBEAT_DISABLED_ALL": "true",
+        "NOMINATIM_URL": f"{stub_url}/nominatim/search",
+        "NOMINATIM_MAX_RPS": "0",
+        "WEATHER_API_URL": f"{stub_url}/weatherapi/v1/forecast.json",
+        "AZURE_OPENAI_ENDPOINT": f"{stub_url}/azure-openai/",
+        "PIN_INDEX_PATH": os.path.join(workdir, "pincodes.db"),
+        "ADVICE_CACHE_PATH": os.path.join(workdir, "advice_cache.db"),
+    }
+
+
+def app_command(server, host, port, workers):
+    if server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-w", str(workers),
+                "-b", f"{host}:{port}", "--log-level", "warning", "main:app"]
+    return [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning"]
+
+
+def wait_ready(url, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{url} exited with code {process.returncode} before becoming ready")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} not ready after {timeout:.0f}s")
+
+
+async def drive(base_url, workload, concurrency, requests, duration):
+    samples = defaultdict(list)  # path -> [(status, latency, time to first byte)]
+    lines = itertools.cycle(workload)
+    sent = 0
+    deadline = time.monotonic() + duration if duration else None
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300.0, limits=limits) as client:
+        async def worker():
+            nonlocal sent
+            while (deadline is None and sent < requests) or (deadline is not None and time.monotonic() < deadline):
+                sent += 1
+                line = next(lines)
+                started = time.perf_counter()
+                first_byte = None
+                try:
+                    async with client.stream(line.get("method", "POST"), line["path"], json=line.get("body")) as response:
+                        async for _ in response.aiter_raw():
+                            if first_byte is None:
+                                first_byte = time.perf_counter() - started
+                        status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                latency = time.perf_counter() - started
+                samples[line["path"]].append((status, latency, first_byte if first_byte is not None else latency))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    report = {}
+    everything = [sample for path_samples in samples.values() for sample in path_samples]
+    for path, path_samples in sorted(samples.items()) + [("TOTAL", everything)]:
+        statuses = np.array([s[0] for s in path_samples])
+        latency_ms = np.array([s[1] for s in path_samples]) * 1000
+        ttfb_ms = np.array([s[2] for s in path_samples]) * 1000
+        p50, p95, p99 = np.percentile(latency_ms, [50, 95, 99])
+        report[path] = {
+            "requests": len(path_samples),
+            "rps": len(path_samples) / elapsed,
+            "4xx": int(((statuses >= 400) & (statuses < 500)).sum()),
+            "errors": int(((statuses == 0) | (statuses >= 500)).sum()),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+            "ttfb_p50_ms": float(np.percentile(ttfb_ms, 50)),
+        }
+    return report
+
+
+def print_report(report, elapsed, upstream_calls):
+    print(f"\n{elapsed:.1f}s elapsed")
+    header = f"{'endpoint':<22}{'reqs':>7}{'rps':>9}{'4xx':>6}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttfb p50':>10}"
+    print(header)
+    print("-" * len(header))
+    for path, row in report.items():
+        print(f"{path:<22}{row['requests']:>7}{row['rps']:>9.1f}{row['4xx']:>6}{row['errors']:>8}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['ttfb_p50_ms']:>10.1f}")
+    if upstream_calls:
+        print("\nupstream calls: " + ", ".join(f"{service}={count}" for service, count in upstream_calls.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an offline load test against stubbed upstreams.")
+    parser.add_argument("--workload", help="JSONL workload file (default: generated with loadtest/workload.py defaults)")
+    parser.add_argument("--server", choices=("uvicorn", "gunicorn"), default="uvicorn")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent client connections")
+    parser.add_argument("--requests", type=int, default=2000, help="requests to send (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="run for this many seconds instead of a request count")
+    parser.add_argument("--app-url", help="drive an already-running app instead of starting one")
+    parser.add_argument("--app-port", type=int, default=9000)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--stub-arg", action="append", default=[], help="extra argument for loadtest/stubs.py")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.workload:
+        with open(args.workload, encoding="utf-8") as f:
+            workload = [json.loads(line) for line in f if line.strip()]
+    else:
+        workload = list(generate(requests=2000, pins=500, batch_size=200, seed=0))
+
+    host = "127.0.0.1"
+    stub_url = f"http://{host}:{args.stub_port}"
+    processes = []
+    try:
+        stubs = subprocess.Popen([sys.executable, os.path.join(HERE, "stubs.py"), "--host", host,
+                                  "--port", str(args.stub_port), *args.stub_arg])
+        processes.append(stubs)
+        wait_ready(f"{stub_url}/stats", stubs)
+
+        base_url = args.app_url
+        if base_url is None:
+            base_url = f"http://{host}:{args.app_port}"
+            workdir = tempfile.mkdtemp(prefix="farmer-loadtest-")
+            app = subprocess.Popen(app_command(args.server, host, args.app_port, args.workers),
+                                   cwd=ROOT, env=app_env(stub_url, workdir))
+            processes.append(app)
+            wait_ready(f"{base_url}/", app)
+
+        samples, elapsed = asyncio.run(drive(base_url, workload, args.concurrency, args.requests, args.duration))
+        report = summarize(samples, elapsed)
+        upstream_calls = httpx.get(f"{stub_url}/stats").json()
+        print_report(report, elapsed, upstream_calls)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"elapsed_seconds": elapsed, "endpoints": report, "upstream_calls": upstream_calls}, f, indent=2)
+    finally:
+        # Stop the app before the stubs so it can flush telemetry
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
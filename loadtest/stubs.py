@@ -0,0 +1,181 @@
+"""Local stand-ins for every upstream the API talks to, for offline load tests.
+
+One server hosts all of them under separate path prefixes:
+
+    /nominatim/search                          Nominatim PIN code search
+    /weatherapi/v1/forecast.json               WeatherAPI 7-day forecast
+    /azure-openai/openai/deployments/...       Azure OpenAI chat completions (incl. streaming)
+    /appinsights/...                           Application Insights ingestion
+
+Responses are deterministic for a given input. Each service gets its own
+simulated latency and error rate:
+
+    python loadtest/stubs.py --port 9100 --latency weatherapi=150 --latency azure-openai=2500 \\
+        --error-rate weatherapi=0.02
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SERVICES = ("nominatim", "weatherapi", "azure-openai", "appinsights")
+DEFAULT_LATENCY_MS = {"nominatim": 400, "weatherapi": 250, "azure-openai": 3000, "appinsights": 50}
+
+ADVICE_TEXT = (
+    "Irrigate early in the morning or late in the evening to cut evaporation losses. "
+    "Mulch between rows to keep soil moisture, check drip lines for leaks, and delay "
+    "fertilizer top-dressing until the soil has enough moisture to take it up."
+)
+
+
+class Behaviour:
+    def __init__(self, latency_ms, jitter, error_rate, token_delay_ms):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_delay_ms = token_delay_ms
+        self.requests = {service: 0 for service in SERVICES}
+
+    async def delay(self, service):
+        self.requests[service] += 1
+        mean = self.latency_ms[service] / 1000
+        await asyncio.sleep(max(0.0, random.gauss(mean, mean * self.jitter)))
+
+    def failure(self, service):
+        if random.random() < self.error_rate.get(service, 0.0):
+            return JSONResponse(status_code=503, content={"error": f"injected {service} failure"})
+        return None
+
+
+def seeded(*parts):
+    return random.Random(hashlib.sha256("|".join(map(str, parts)).encode()).digest())
+
+
+def create_app(behaviour):
+    app = FastAPI()
+    app.state.behaviour = behaviour
+
+    @app.get("/stats")
+    def stats():
+        return behaviour.requests
+
+    @app.get("/nominatim/search")
+    async def nominatim(postalcode: str = ""):
+        await behaviour.delay("nominatim")
+        if failure := behaviour.failure("nominatim"):
+            return failure
+        # PINs starting with 0 do not exist in India
+        if not postalcode.isdigit() or postalcode.startswith("0"):
+            return []
+        rng = seeded("pin", postalcode)
+        return [{"lat": f"{rng.uniform(8.0, 32.0):.6f}", "lon": f"{rng.uniform(69.0, 90.0):.6f}"}]
+
+    @app.get("/weatherapi/v1/forecast.json")
+    async def weatherapi(q: str = "", days: int = 7):
+        await behaviour.delay("weatherapi")
+        if failure := behaviour.failure("weatherapi"):
+            return failure
+        rng = seeded("weather", q)
+        today = datetime.date.today()
+        forecast_days = []
+        for d in range(days):
+            temp_max = rng.uniform(26, 42)
+            forecast_days.append({
+                "date": (today + datetime.timedelta(days=d)).isoformat(),
+                "day": {
+                    "totalprecip_mm": round(rng.choice([0.0, 0.0, rng.uniform(0, 6), rng.uniform(5, 40), rng.uniform(60, 120)]), 1),
+                    "maxtemp_c": round(temp_max, 1),
+                    "mintemp_c": round(temp_max - rng.uniform(6, 16), 1),
+                    "maxwind_kph": round(rng.uniform(5, 55), 1),
+                    "avghumidity": rng.randint(40, 98),
+                    "condition": {"text": rng.choice(["Sunny", "Partly cloudy", "Patchy rain possible", "Moderate rain"])},
+                },
+            })
+        return {
+            "location": {"name": f"Village {q}", "region": f"District {int(rng.uniform(1, 40))}"},
+            "forecast": {"forecastday": forecast_days},
+        }
+
+    @app.post("/azure-openai/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        await behaviour.delay("azure-openai")
+        if failure := behaviour.failure("azure-openai"):
+            return failure
+        words = ADVICE_TEXT.split(" ")
+        usage = {"prompt_tokens": 40, "completion_tokens": len(words), "total_tokens": 40 + len(words)}
+
+        if not body.get("stream"):
+            return {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": deployment,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": ADVICE_TEXT}}],
+                "usage": usage,
+            }
+
+        async def chunks():
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": deployment,
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(behaviour.token_delay_ms / 1000)
+            if body.get("stream_options", {}).get("include_usage"):
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": deployment, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.post("/appinsights/{path:path}")
+    async def appinsights(path: str, request: Request):
+        items = (await request.body()).count(b'"iKey"')
+        await behaviour.delay("appinsights")
+        if failure := behaviour.failure("appinsights"):
+            return failure
+        return {"itemsReceived": items, "itemsAccepted": items, "errors": []}
+
+    return app
+
+
+def parse_overrides(pairs, cast):
+    overrides = {}
+    for pair in pairs:
+        service, _, value = pair.partition("=")
+        if service not in SERVICES:
+            raise SystemExit(f"Unknown service '{service}'; expected one of {', '.join(SERVICES)}")
+        overrides[service] = cast(value)
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the API's upstream services.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=MS",
+                        help="mean simulated latency per service in ms")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency std-dev as a fraction of the mean")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="SERVICE=FRACTION",
+                        help="fraction of requests answered with a 503")
+    parser.add_argument("--token-delay", type=float, default=20.0, help="delay between streamed tokens in ms")
+    args = parser.parse_args()
+
+    behaviour = Behaviour(
+        latency_ms={**DEFAULT_LATENCY_MS, **parse_overrides(args.latency, float)},
+        jitter=args.jitter,
+        error_rate=parse_overrides(args.error_rate, float),
+        token_delay_ms=args.token_delay,
+    )
+    uvicorn.run(create_app(behaviour), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Generates a replayable JSONL workload for loadtest/run.py.
+
+Each line is one request:
+
+    {"method": "POST", "path": "/analyze", "body": {"pin_code": "560001", "crop_name": "rice"}}
+
+Farmers cluster by district, so PINs are drawn from a fixed pool with a
+Zipf-like skew. That gives the caches the same hot-spot pattern they see in
+production.
+
+    python loadtest/workload.py --requests 5000 --pins 800 > workload.jsonl
+"""
+import argparse
+import json
+import random
+import sys
+
+CROP_WEIGHTS = {"rice": 40, "wheat": 30, "maize": 15, "sugarcane": 10, "cotton": 5}  # cotton is unsupported
+ENDPOINT_WEIGHTS = {"/analyze": 70, "/analyze/stream": 15, "/analyze/all-crops": 10, "/analyze/batch": 5}
+
+
+def generate(requests, pins, batch_size, seed):
+    rng = random.Random(seed)
+    pool = [str(rng.randint(110001, 855999)) for _ in range(pins)]
+    pin_weights = [1 / (rank + 1) for rank in range(pins)]
+    crops, crop_weights = list(CROP_WEIGHTS), list(CROP_WEIGHTS.values())
+    paths, path_weights = list(ENDPOINT_WEIGHTS), list(ENDPOINT_WEIGHTS.values())
+
+    def record():
+        return {"pin_code": rng.choices(pool, pin_weights)[0], "crop_name": rng.choices(crops, crop_weights)[0]}
+
+    for _ in range(requests):
+        path = rng.choices(paths, path_weights)[0]
+        if path == "/analyze/batch":
+            body = [record() for _ in range(rng.randint(batch_size // 2, batch_size))]
+        elif path == "/analyze/all-crops":
+            body = {"pin_code": record()["pin_code"]}
+        else:
+            body = record()
+        yield {"method": "POST", "path": path, "body": body}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a load-test workload as JSONL on stdout.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--pins", type=int, default=500, help="distinct PIN codes in the pool")
+    parser.add_argument("--batch-size", type=int, default=200, help="largest /analyze/batch payload")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for line in generate(args.requests, args.pins, args.batch_size, args.seed):
+        sys.stdout.write(json.dumps(line) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,154 +1,389 @@
+import time
+IMPORT_STARTED = time.perf_counter()  # start of the import-to-ready measurement
+
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
-from azure.identity import ManagedIdentityCredential
-from azure.keyvault.secrets import SecretClient
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from azure.monitor.opentelemetry.exporter import AzureMonitorTraceExporter
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
+import asyncio
+import json
+import logging
 import os
-import requests
+from contextlib import asynccontextmanager
+from typing import List
+
+from advice import AdviceService, AdviceStore, create_openai_client
+from forecast import ForecastCache, grid_cell
+from geocoding import Geocoder, PinIndex
+from risk_engine import CROP_RISK_PROFILES, RISK_RECOMMENDATIONS, RiskEngine, describe, forecast_features, stack_features
+from secret_provider import default_provider
+from telemetry import STARTUP_SECONDS, MetricsMiddleware, registry, sampler, stage, watch_cache
+from upstream import RateLimited, UpstreamError, create_http_client
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+# Secrets are fetched in the lifespan handler, not at import, and are reused
+# from the environment when the gunicorn master preloaded them (gunicorn.conf.py)
+secrets = default_provider()
+
+def setup_tracing():
+    # Application Insights setup
+    os.environ["APPLICATION_INSIGHTS_CONNECTION_STRING"] = secrets.get("ApplicationInsightsConnectionString")
+    provider = TracerProvider(sampler=sampler())
+    if os.environ["APPLICATION_INSIGHTS_CONNECTION_STRING"]:
+        exporter = AzureMonitorTraceExporter(connection_string=os.getenv("APPLICATION_INSIGHTS_CONNECTION_STRING"))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return provider
+
+def record_startup(app, secrets_seconds):
+    ready = time.perf_counter() - IMPORT_STARTED
+    app.state.startup = {"import_to_ready_seconds": ready, "secrets_seconds": secrets_seconds}
+    span = tracer.start_span("worker_startup", start_time=time.time_ns() - int(ready * 1e9), attributes={
+        "startup.import_to_ready_seconds": ready,
+        "startup.secrets_seconds": secrets_seconds,
+    })
+    span.end()
+    STARTUP_SECONDS.set(ready, phase="import_to_ready")
+    STARTUP_SECONDS.set(secrets_seconds, phase="secrets")
+    logger.info("Worker %s ready in %.3fs (secrets %.3fs)", os.getpid(), ready, secrets_seconds)
 
-# Ensure AzureOpenAI is imported properly
-from openai import AzureOpenAI  # adjust this import if you're using a specific SDK
+@asynccontextmanager
+async def lifespan(app):
+    secrets_started = time.perf_counter()
+    await asyncio.to_thread(secrets.load)
+    secrets_seconds = time.perf_counter() - secrets_started
+    tracer_provider = setup_tracing()
 
-# Set environment variable early for Application Insights
-KEY_VAULT_URL = "https://kv-cld-farmer-poc.vault.azure.net/"
-#credential = DefaultAzureCredential()
-#credential = DefaultAzureCredential(additionally_allowed_tenants=["*"])
-credential = ManagedIdentityCredential()
-client = SecretClient(vault_url=KEY_VAULT_URL, credential=credential)
+    # Pooled upstream clients, shared by every request in this worker
+    http = create_http_client()
+    openai_client = create_openai_client(secrets.get("OpenSubscriptionKey"))
 
-WEATHER_API_KEY = client.get_secret("OpenWeatherAPIKey").value
-OPENAI_SUB_API_KEY = client.get_secret("OpenSubscriptionKey").value
-APP_INSIGHTS_KEY = client.get_secret("ApplicationInsightsConnectionString").value
-os.environ["APPLICATION_INSIGHTS_CONNECTION_STRING"] = APP_INSIGHTS_KEY
+    # PIN code geocoding: local index first, Nominatim only as a fallback
+    app.state.geocoder = Geocoder(PinIndex(), http)
+    # Weather forecasts, cached per grid cell
+    app.state.forecasts = ForecastCache(http, secrets.get("OpenWeatherAPIKey"))
+    # LLM crop advice, cached across workers
+    app.state.advice = AdviceService(openai_client, store=AdviceStore())
+    watch_cache("pin", app.state.geocoder.cache)
+    watch_cache("forecast", app.state.forecasts.cache)
+    watch_cache("advice", app.state.advice.cache)
+
+    # Rotated keys take effect without a restart
+    def apply_rotated(changed):
+        if "OpenWeatherAPIKey" in changed:
+            app.state.forecasts.api_key = changed["OpenWeatherAPIKey"]
+        if "OpenSubscriptionKey" in changed:
+            openai_client.api_key = changed["OpenSubscriptionKey"]
+    secrets.on_refresh(apply_rotated)
+    secrets.start_refresh()
+
+    record_startup(app, secrets_seconds)
+    try:
+        yield
+    finally:
+        secrets.stop_refresh()
+        await http.aclose()
+        await openai_client.close()
+        tracer_provider.shutdown()
 
 # CORS middleware
-app = FastAPI() #FastAPI instance
+app = FastAPI(lifespan=lifespan) #FastAPI instance
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Replace "*" with your frontend domain in production
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
-# Application Insights setup
-exporter = AzureMonitorTraceExporter(connection_string=os.getenv("APPLICATION_INSIGHTS_CONNECTION_STRING"))
-provider = TracerProvider()
-processor = BatchSpanProcessor(exporter)
-provider.add_span_processor(processor)
-trace.set_tracer_provider(provider)
-tracer = trace.get_tracer(__name__)
+# Crop risk rules, compiled once into a profile matrix
+risk_engine = RiskEngine(CROP_RISK_PROFILES)
 
-# Risk profiles and mappings (same as before)
-CROP_RISK_PROFILES = {
-    "rice": {"min_rain_mm": 5, "max_temp_c": 38, "min_temp_c": 20, "max_wind_kmph": 40, "max_humidity": 90},
-    "wheat": {"min_rain_mm": 2, "max_temp_c": 32, "min_temp_c": 10, "max_wind_kmph": 35, "max_humidity": 85},
-    "maize": {"min_rain_mm": 3, "max_temp_c": 35, "min_temp_c": 18, "max_wind_kmph": 45, "max_humidity": 88},
-    "sugarcane": {"min_rain_mm": 4, "max_temp_c": 40, "min_temp_c": 15, "max_wind_kmph": 50, "max_humidity": 92}
-}
-RISK_RECOMMENDATIONS = {
-    "drought": "Irrigate early morning or late evening to reduce evaporation.",
-    "flood": "Ensure proper drainage; avoid nitrogen fertilizer applications.",
-    "heat": "Provide temporary shading; irrigate during cooler hours.",
-    "cold": "Use mulch or crop covers to protect from low temperatures.",
-    "wind": "Support tall crops like sugarcane; install wind barriers.",
-    "humidity": "Inspect crops for fungal symptoms; apply fungicide if needed."
-}
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+# Geocode misses queue on the Nominatim rate limiter, so keep them off the shared fan-out slots
+BATCH_GEOCODE_CONCURRENCY = int(os.getenv("BATCH_GEOCODE_CONCURRENCY", "2"))
+BATCH_MAX_RECORDS = int(os.getenv("BATCH_MAX_RECORDS", "10000"))
 
 class UserInput(BaseModel):
     pin_code: str
     crop_name: str
 
+class LocationInput(BaseModel):
+    pin_code: str
+
+class AnalysisError(Exception):
+    """A request-level failure that maps to an HTTP error response."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def upstream_status(e):
+    if isinstance(e.cause, RateLimited):
+        return 503
+    return 504 if isinstance(e.cause, asyncio.TimeoutError) else 502
+
+def error_response(e):
+    """Maps an exception raised while analyzing a request to its JSON error response."""
+    if isinstance(e, AnalysisError):
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+
+    with tracer.start_as_current_span("exception_handling"):
+        span = trace.get_current_span()
+        if isinstance(e, UpstreamError):
+            span.set_attributes({"upstream.stage": e.stage, "upstream.error": type(e.cause).__name__})
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            return JSONResponse(status_code=upstream_status(e),
+                                content={"error": f"Upstream {e.stage} request failed."})
+        span.record_exception(e)
+        span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+    return JSONResponse(status_code=500, content={"error": "Internal Server Error", "detail": str(e)})
+
+async def locate(state, pin_code):
+    with stage("geocode"):
+        location = await state.geocoder.lookup(pin_code)
+    if location is None:
+        raise AnalysisError(400, "Invalid PIN code or location not found.")
+    return location
+
+async def fetch_forecast(state, lat, lon):
+    with stage("forecast"):
+        weather_response = await state.forecasts.get(lat, lon)
+    if not weather_response.get("forecast", {}).get("forecastday"):
+        raise AnalysisError(502, "Failed to fetch weather forecast.")
+    return weather_response
+
+def forecast_summary(forecast_days):
+    today = forecast_days[0]
+    return f"{today['date']}: {today['day']['condition']['text']}, Max Temp: {today['day']['maxtemp_c']}°C"
+
+def evaluate_risks(weather_response):
+    """All crops x days x risk types for one forecast; see RiskEngine.evaluate."""
+    return risk_engine.evaluate(forecast_features(weather_response["forecast"]["forecastday"]))
+
+def detect(crop_name, weather_response, hits=None):
+    """Rule-based risks for one crop: (detected_risks, risk_types, static recommendations)."""
+    crop = risk_engine.crop_index(crop_name)
+    if crop is None:
+        raise AnalysisError(400, f"Crop '{crop_name}' not supported.")
+
+    with stage("rules"):
+        if hits is None:
+            hits = evaluate_risks(weather_response)
+        detected_risks, risk_types = describe(hits[crop], [day["date"] for day in weather_response["forecast"]["forecastday"]])
+        recommendations = [RISK_RECOMMENDATIONS[risk] for risk in risk_types if risk != "drought"]
+    return detected_risks, risk_types, recommendations
+
+async def assess(state, crop_name, weather_response, hits=None):
+    detected_risks, risk_types, recommendations = detect(crop_name, weather_response, hits)
+
+    # A single LLM call per request, and only when drought is in the forecast
+    if "drought" in risk_types:
+        with stage("advice"):
+            recommendations.append(await state.advice.get(crop_name, risk_types, weather_response["location"]["region"]))
+
+    return {
+        "location": weather_response["location"]["name"],
+        "region": weather_response["location"]["region"],
+        "crop": crop_name,
+        "forecast_summary": forecast_summary(weather_response["forecast"]["forecastday"]),
+        "detected_risks": list(set(detected_risks)),
+        "recommendations": list(set(recommendations))
+    }
+
 @app.get("/")
 def read_root():
     return {"message": "Farmer Copilot API running"}
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of this worker's latency, error, cache and token metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/analyze")
-def analyze(input: UserInput):
+async def analyze(input: UserInput, request: Request):
+    state = request.app.state
     try:
         with tracer.start_as_current_span("analyze_weather_risks"):
             # Step 1: Get lat/lon from pincode
-            geo_url = f"https://nominatim.openstreetmap.org/search?postalcode={input.pin_code}&country=India&format=json"
-            geo_response = requests.get(geo_url, headers={"User-Agent": "FarmerCopilotApp/1.0"}).json()
-            if not geo_response:
-                return JSONResponse(status_code=400, content={"error": "Invalid PIN code or location not found."})
-            lat, lon = geo_response[0]["lat"], geo_response[0]["lon"]
+            lat, lon = await locate(state, input.pin_code)
 
             # Step 2: Get weather forecast
-            weather_url = f"https://api.weatherapi.com/v1/forecast.json?key={WEATHER_API_KEY}&q={lat},{lon}&days=7"
-            weather_response = requests.get(weather_url).json()
-            forecast_days = weather_response.get("forecast", {}).get("forecastday", [])
-            if not forecast_days:
-                return JSONResponse(status_code=502, content={"error": "Failed to fetch weather forecast."})
+            weather_response = await fetch_forecast(state, lat, lon)
 
             # Step 3: Analyze
-            profile = CROP_RISK_PROFILES.get(input.crop_name.lower())
-            if not profile:
-                return JSONResponse(status_code=400, content={"error": f"Crop '{input.crop_name}' not supported."})
-
-            detected_risks, recommendations = [], []
-
-            for day in forecast_days:
-                date, weather = day["date"], day["day"]
-                rain, temp_max, temp_min = weather.get("totalprecip_mm", 0), weather.get("maxtemp_c", 0), weather.get("mintemp_c", 0)
-                wind, humidity = weather.get("maxwind_kph", 0), weather.get("avghumidity", 0)
-
-                if rain < profile["min_rain_mm"]:
-                    detected_risks.append(f"Drought risk on {date}")
-                    client = AzureOpenAI(
-                        api_version="2024-12-01-preview",
-                        azure_endpoint="https://chat-with-db.openai.azure.com/",
-                        api_key=OPENAI_SUB_API_KEY,
-                    )
-                    response = client.chat.completions.create(
-                        messages=[
-                            {"role": "system", "content": "You are a farmer and weather assistant."},
-                            {"role": "user", "content": f"Given PIN {input.pin_code} and crop {input.crop_name}, what should a farmer do in case of drought, flood, heat, cold, wind, or humidity?"}
-                        ],
-                        max_completion_tokens=800,
-                        temperature=1.0,
-                        top_p=1.0,
-                        frequency_penalty=0.0,
-                        presence_penalty=0.0,
-                        model="gpt-4.1"
-                    )
-                    recommendations.append(response.choices[0].message.content)
-
-                if rain > 80:
-                    detected_risks.append(f"Flood risk on {date}")
-                    recommendations.append(RISK_RECOMMENDATIONS["flood"])
-                if temp_max > profile["max_temp_c"]:
-                    detected_risks.append(f"Heat stress on {date}")
-                    recommendations.append(RISK_RECOMMENDATIONS["heat"])
-                if temp_min < profile["min_temp_c"]:
-                    detected_risks.append(f"Cold/frost risk on {date}")
-                    recommendations.append(RISK_RECOMMENDATIONS["cold"])
-                if wind > profile["max_wind_kmph"]:
-                    detected_risks.append(f"Wind damage risk on {date}")
-                    recommendations.append(RISK_RECOMMENDATIONS["wind"])
-                if humidity > profile["max_humidity"] and temp_max > 30:
-                    detected_risks.append(f"Pest/disease risk on {date}")
-                    recommendations.append(RISK_RECOMMENDATIONS["humidity"])
-
-            today = forecast_days[0]
-            summary = f"{today['date']}: {today['day']['condition']['text']}, Max Temp: {today['day']['maxtemp_c']}°C"
+            return await assess(state, input.crop_name, weather_response)
 
+    except Exception as e:
+        return error_response(e)
+
+@app.post("/analyze/all-crops")
+async def analyze_all_crops(input: LocationInput, request: Request):
+    """Ranks every supported crop from safest to riskiest for the coming week."""
+    state = request.app.state
+    try:
+        with tracer.start_as_current_span("analyze_all_crops"):
+            lat, lon = await locate(state, input.pin_code)
+            weather_response = await fetch_forecast(state, lat, lon)
+            crops = risk_engine.rank(evaluate_risks(weather_response))
             return {
                 "location": weather_response["location"]["name"],
                 "region": weather_response["location"]["region"],
-                "crop": input.crop_name,
-                "forecast_summary": summary,
-                "detected_risks": list(set(detected_risks)),
-                "recommendations": list(set(recommendations))
+                "forecast_summary": forecast_summary(weather_response["forecast"]["forecastday"]),
+                "safest_crop": crops[0]["crop"],
+                "crops": crops
             }
 
     except Exception as e:
-        with tracer.start_as_current_span("exception_handling"):
-            trace.get_current_span().record_exception(e)
-            trace.get_current_span().set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
-        return JSONResponse(status_code=500, content={"error": "Internal Server Error", "detail": str(e)})
+        return error_response(e)
+
+@app.post("/analyze/stream")
+async def analyze_stream(input: UserInput, request: Request):
+    """Server-sent-events variant of /analyze that sends each part as soon as it is known.
+
+    Events, in order: ``forecast`` (location and forecast summary), ``risks``
+    (rule-based risks and static recommendations), zero or more ``advice``
+    events carrying LLM tokens, then ``done``. Failures after the stream has
+    started arrive as an ``error`` event.
+    """
+    if risk_engine.crop_index(input.crop_name) is None:
+        return JSONResponse(status_code=400, content={"error": f"Crop '{input.crop_name}' not supported."})
+
+    state = request.app.state
+
+    async def events():
+        with tracer.start_as_current_span("analyze_stream"):
+            try:
+                lat, lon = await locate(state, input.pin_code)
+                weather_response = await fetch_forecast(state, lat, lon)
+                yield sse("forecast", {
+                    "location": weather_response["location"]["name"],
+                    "region": weather_response["location"]["region"],
+                    "crop": input.crop_name,
+                    "forecast_summary": forecast_summary(weather_response["forecast"]["forecastday"])
+                })
+
+                detected_risks, risk_types, recommendations = detect(input.crop_name, weather_response)
+                yield sse("risks", {
+                    "detected_risks": list(set(detected_risks)),
+                    "recommendations": list(set(recommendations))
+                })
+
+                if "drought" in risk_types:
+                    region = weather_response["location"]["region"]
+                    with stage("advice"):
+                        async for delta in state.advice.stream(input.crop_name, risk_types, region):
+                            yield sse("advice", {"delta": delta})
+
+                yield sse("done", {})
+
+            except AnalysisError as e:
+                yield sse("error", {"status": e.status_code, "error": e.message})
+            except UpstreamError as e:
+                yield sse("error", {"status": upstream_status(e), "error": f"Upstream {e.stage} request failed."})
+            except Exception as e:
+                with tracer.start_as_current_span("exception_handling"):
+                    trace.get_current_span().record_exception(e)
+                    trace.get_current_span().set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+                yield sse("error", {"status": 500, "error": "Internal Server Error", "detail": str(e)})
+
+    # Disable proxy buffering so each event reaches slow clients immediately
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/analyze/batch")
+async def analyze_batch(records: List[UserInput], request: Request):
+    """Analyzes many records, streaming one NDJSON line per record as it completes.
+
+    Records are grouped so that each distinct PIN is geocoded once and each
+    distinct forecast grid cell is fetched and risk-evaluated (for all crops)
+    once. Geocoding runs with at most BATCH_GEOCODE_CONCURRENCY lookups in
+    flight, other upstream work with at most BATCH_CONCURRENCY. Forecasts that
+    arrive in the same event-loop iteration are risk-evaluated together in one
+    stacked RiskEngine pass.
+    """
+    if len(records) > BATCH_MAX_RECORDS:
+        return JSONResponse(status_code=413, content={"error": f"Batch exceeds {BATCH_MAX_RECORDS} records."})
+
+    state = request.app.state
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+    geocode_limit = asyncio.Semaphore(BATCH_GEOCODE_CONCURRENCY)
+    pin_tasks, cell_tasks = {}, {}
+
+    async def bounded(coro, semaphore=limit):
+        async with semaphore:
+            return await coro
+
+    def shared(tasks, key, factory, semaphore=limit):
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(bounded(factory(), semaphore))
+        return task
+
+    wave = []  # (forecast days, future) awaiting the next stacked evaluation
+
+    def evaluate_wave():
+        pending = wave[:]
+        wave.clear()
+        try:
+            with stage("rules"):
+                hits = risk_engine.evaluate(stack_features([forecast_days for forecast_days, _ in pending]))
+        except Exception as e:
+            hits = [e] * len(pending)
+        for (forecast_days, future), cell_hits in zip(pending, hits):
+            if future.done():
+                continue
+            if isinstance(cell_hits, Exception):
+                future.set_exception(cell_hits)
+            else:
+                # Drop the NaN padding of shorter forecasts
+                future.set_result(cell_hits[:, :len(forecast_days)])
+
+    async def cell_forecast(cell):
+        weather_response = await fetch_forecast(state, *cell)
+        loop = asyncio.get_running_loop()
+        hits = loop.create_future()
+        wave.append((weather_response["forecast"]["forecastday"], hits))
+        if len(wave) == 1:
+            loop.call_soon(evaluate_wave)
+        return weather_response, await hits
+
+    async def run(index, record):
+        try:
+            pin_code = record.pin_code.strip()
+            lat, lon = await shared(pin_tasks, pin_code, lambda: locate(state, pin_code), geocode_limit)
+            cell = grid_cell(lat, lon, state.forecasts.grid)
+            weather_response, hits = await shared(cell_tasks, cell, lambda: cell_forecast(cell))
+            result = await bounded(assess(state, record.crop_name, weather_response, hits))
+            return {"index": index, "status": 200, "result": result}
+        except AnalysisError as e:
+            return {"index": index, "status": e.status_code, "error": e.message}
+        except UpstreamError as e:
+            return {"index": index, "status": upstream_status(e), "error": f"Upstream {e.stage} request failed."}
+        except Exception as e:
+            return {"index": index, "status": 500, "error": "Internal Server Error", "detail": str(e)}
+
+    async def stream():
+        # Tasks start only once the body is being sent, so the finally below
+        # always covers them, even if the client is gone before that
+        tasks = [asyncio.ensure_future(run(index, record)) for index, record in enumerate(records)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # Stop outstanding work if the client goes away mid-stream
+            for task in [*tasks, *pin_tasks.values(), *cell_tasks.values()]:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
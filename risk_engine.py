@@ -0,0 +1,109 @@
+import numpy as np
+
+# Risk profiles and mappings
+CROP_RISK_PROFILES = {
+    "rice": {"min_rain_mm": 5, "max_temp_c": 38, "min_temp_c": 20, "max_wind_kmph": 40, "max_humidity": 90},
+    "wheat": {"min_rain_mm": 2, "max_temp_c": 32, "min_temp_c": 10, "max_wind_kmph": 35, "max_humidity": 85},
+    "maize": {"min_rain_mm": 3, "max_temp_c": 35, "min_temp_c": 18, "max_wind_kmph": 45, "max_humidity": 88},
+    "sugarcane": {"min_rain_mm": 4, "max_temp_c": 40, "min_temp_c": 15, "max_wind_kmph": 50, "max_humidity": 92}
+}
+RISK_RECOMMENDATIONS = {
+    "drought": "Irrigate early morning or late evening to reduce evaporation.",
+    "flood": "Ensure proper drainage; avoid nitrogen fertilizer applications.",
+    "heat": "Provide temporary shading; irrigate during cooler hours.",
+    "cold": "Use mulch or crop covers to protect from low temperatures.",
+    "wind": "Support tall crops like sugarcane; install wind barriers.",
+    "humidity": "Inspect crops for fungal symptoms; apply fungicide if needed."
+}
+
+RISK_TYPES = ("drought", "flood", "heat", "cold", "wind", "humidity")
+RISK_LABELS = {
+    "drought": "Drought risk",
+    "flood": "Flood risk",
+    "heat": "Heat stress",
+    "cold": "Cold/frost risk",
+    "wind": "Wind damage risk",
+    "humidity": "Pest/disease risk",
+}
+# WeatherAPI day fields, in feature-column order
+FEATURES = ("totalprecip_mm", "maxtemp_c", "mintemp_c", "maxwind_kph", "avghumidity")
+# Profile thresholds, in profile-column order
+THRESHOLDS = ("min_rain_mm", "max_temp_c", "min_temp_c", "max_wind_kmph", "max_humidity")
+FLOOD_RAIN_MM = 80
+PEST_MIN_TEMP_C = 30
+
+RAIN, TEMP_MAX, TEMP_MIN, WIND, HUMIDITY = range(len(FEATURES))
+
+
+def forecast_features(forecast_days):
+    """Turns WeatherAPI ``forecastday`` entries into a (days, features) array."""
+    return np.array([[day["day"].get(name, 0) for name in FEATURES] for day in forecast_days], dtype=float)
+
+
+def stack_features(forecasts):
+    """Stacks several locations' forecasts into a (locations, days, features) array.
+
+    Shorter forecasts are padded with NaN, which never trips a threshold.
+    """
+    days = max((len(forecast_days) for forecast_days in forecasts), default=0)
+    features = np.full((len(forecasts), days, len(FEATURES)), np.nan)
+    for i, forecast_days in enumerate(forecasts):
+        if forecast_days:
+            features[i, :len(forecast_days)] = forecast_features(forecast_days)
+    return features
+
+
+class RiskEngine:
+    """Evaluates every crop x day x risk type rule in one vectorized pass.
+
+    The crop profiles are compiled into a (crops, thresholds) matrix once;
+    ``evaluate`` then broadcasts any (..., days, features) forecast array
+    against it, so a single location and a district-wide batch of locations
+    go through the same code path.
+    """
+
+    def __init__(self, profiles=CROP_RISK_PROFILES):
+        self.crops = tuple(profiles)
+        self.profiles = np.array([[profile[name] for name in THRESHOLDS] for profile in profiles.values()], dtype=float)
+        self._index = {crop: i for i, crop in enumerate(self.crops)}
+
+    def crop_index(self, crop_name):
+        return self._index.get(crop_name.lower())
+
+    def evaluate(self, features):
+        """Returns a boolean array of shape (..., crops, days, risk types)."""
+        features = np.asarray(features, dtype=float)[..., None, :, :]
+        profiles = self.profiles[:, None, :]
+        rain, temp_max, temp_min = features[..., RAIN], features[..., TEMP_MAX], features[..., TEMP_MIN]
+        wind, humidity = features[..., WIND], features[..., HUMIDITY]
+
+        shape = np.broadcast_shapes(rain.shape, profiles[..., 0].shape)
+        hits = np.empty(shape + (len(RISK_TYPES),), dtype=bool)
+        hits[..., 0] = rain < profiles[..., 0]
+        hits[..., 1] = rain > FLOOD_RAIN_MM
+        hits[..., 2] = temp_max > profiles[..., 1]
+        hits[..., 3] = temp_min < profiles[..., 2]
+        hits[..., 4] = wind > profiles[..., 3]
+        hits[..., 5] = (humidity > profiles[..., 4]) & (temp_max > PEST_MIN_TEMP_C)
+        return hits
+
+    def rank(self, hits):
+        """Orders crops from safest to riskiest for one location's (crops, days, risk types) hits."""
+        risk_days = hits.any(axis=2).sum(axis=1)
+        risk_count = hits.sum(axis=(1, 2))
+        ranking = []
+        for i in np.lexsort((risk_count, risk_days)):
+            ranking.append({
+                "crop": self.crops[i],
+                "risk_days": int(risk_days[i]),
+                "risk_count": int(risk_count[i]),
+                "risk_types": [RISK_TYPES[r] for r in np.flatnonzero(hits[i].any(axis=0))],
+            })
+        return ranking
+
+
+def describe(hits, dates):
+    """Renders one crop's (days, risk types) hits as messages plus the set of risk types hit."""
+    detected_risks = [f"{RISK_LABELS[RISK_TYPES[r]]} on {dates[d]}" for d, r in zip(*np.nonzero(hits))]
+    risk_types = {RISK_TYPES[r] for r in np.flatnonzero(hits.any(axis=0))}
+    return detected_risks, risk_types
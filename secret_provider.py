@@ -0,0 +1,184 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+KEY_VAULT_URL = os.getenv("KEY_VAULT_URL", "https://kv-cld-farmer-poc.vault.azure.net/")
+SECRETS_SOURCE = os.getenv("SECRETS_SOURCE", "keyvault")  # "keyvault" or "local"
+SECRETS_FILE = os.getenv("SECRETS_FILE")
+SECRETS_REFRESH_SECONDS = float(os.getenv("SECRETS_REFRESH_SECONDS", "3600"))
+
+# Secrets the API needs, by Key Vault name
+APP_SECRETS = ("OpenWeatherAPIKey", "OpenSubscriptionKey", "ApplicationInsightsConnectionString")
+
+# Set by export_env alongside the SECRET_* values: which names were exported
+# from the authoritative source, and when they were loaded (Unix time)
+PRELOADED_ENV = "SECRETS_PRELOADED"
+LOADED_AT_ENV = "SECRETS_LOADED_AT"
+
+
+def env_var(name):
+    """Environment variable holding secret ``name``, e.g. SECRET_OPENWEATHERAPIKEY."""
+    return "SECRET_" + re.sub(r"[^A-Za-z0-9]", "_", name).upper()
+
+
+class EnvSource:
+    """Secrets from SECRET_* environment variables (also how preloaded secrets reach workers)."""
+
+    def fetch(self, names):
+        return {name: os.environ[env_var(name)] for name in names if env_var(name) in os.environ}
+
+    def preloaded(self):
+        """Names the gunicorn master exported from the authoritative source, and when it loaded them."""
+        names = {name for name in os.getenv(PRELOADED_ENV, "").split(",") if name}
+        return names, float(os.getenv(LOADED_AT_ENV, "0"))
+
+
+class FileSource:
+    """Secrets from a ``Name=value`` file, one per line, for local runs and tests."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, names):
+        values = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                name, value = line.split("=", 1)
+                values[name.strip()] = value.strip()
+        return {name: values[name] for name in names if name in values}
+
+
+class KeyVaultSource:
+    """Secrets from Azure Key Vault, fetched concurrently with one managed-identity token."""
+
+    def __init__(self, vault_url=KEY_VAULT_URL):
+        from azure.identity import ManagedIdentityCredential
+        from azure.keyvault.secrets import SecretClient
+
+        self._credential = ManagedIdentityCredential()
+        self._client = SecretClient(vault_url=vault_url, credential=self._credential)
+
+    def fetch(self, names):
+        # Warm the credential's token cache so the parallel fetches share one token
+        self._credential.get_token("https://vault.azure.net/.default")
+        with ThreadPoolExecutor(max_workers=max(1, len(names))) as pool:
+            values = pool.map(lambda name: self._client.get_secret(name).value, names)
+            return dict(zip(names, values))
+
+
+class SecretProvider:
+    """Loads secrets once, caches them, and optionally refreshes them in the background.
+
+    ``load`` asks each source in turn for the secrets still missing, so values
+    exported by the gunicorn master (see ``export_env``) are picked up from the
+    environment without another Key Vault round trip. ``start_refresh`` re-reads
+    the last (authoritative) source every ``refresh_interval`` seconds and
+    notifies ``on_refresh`` callbacks of the new values. Only values that came
+    from that source (directly or via the master's export) are refreshed, so a
+    SECRET_* override set by an operator stays in place. The first refresh is
+    due ``refresh_interval`` after the values were originally loaded, which for
+    preloaded values is when the master loaded them.
+    """
+
+    def __init__(self, names, sources, refresh_interval=SECRETS_REFRESH_SECONDS):
+        self.names = tuple(names)
+        self.sources = list(sources)
+        self.refresh_interval = refresh_interval
+        self._values = {}
+        self._refreshable = set()  # names whose value came from the last source
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        with self._lock:
+            missing = [name for name in self.names if name not in self._values]
+            for source in self.sources:
+                if not missing:
+                    break
+                values = source.fetch(missing)
+                self._values.update(values)
+                if source is self.sources[-1]:
+                    self._mark_refreshable(values, time.time())
+                elif isinstance(source, EnvSource):
+                    names, loaded_at = source.preloaded()
+                    self._mark_refreshable(names & values.keys(), loaded_at)
+                missing = [name for name in self.names if name not in self._values]
+            if missing:
+                raise KeyError(f"Secrets not found in any source: {', '.join(missing)}")
+            return dict(self._values)
+
+    def get(self, name):
+        value = self._values.get(name)
+        if value is None:
+            value = self.load()[name]
+        return value
+
+    def _mark_refreshable(self, names, loaded_at):
+        if names:
+            self._refreshable.update(names)
+            self._loaded_at = loaded_at if self._loaded_at is None else min(self._loaded_at, loaded_at)
+
+    def export_env(self):
+        for name, value in self.load().items():
+            os.environ[env_var(name)] = value
+        os.environ[PRELOADED_ENV] = ",".join(sorted(self._refreshable))
+        os.environ[LOADED_AT_ENV] = repr(self._loaded_at or time.time())
+
+    def on_refresh(self, callback):
+        self._callbacks.append(callback)
+
+    def refresh(self):
+        names = [name for name in self.names if name in self._refreshable]
+        if not names:
+            return {}
+        values = self.sources[-1].fetch(names)
+        with self._lock:
+            changed = {name: value for name, value in values.items() if self._values.get(name) != value}
+            self._values.update(values)
+            self._loaded_at = time.time()
+        if changed:
+            for callback in self._callbacks:
+                callback(changed)
+        return changed
+
+    def start_refresh(self):
+        if self.refresh_interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._refresh_loop, name="secret-refresh", daemon=True)
+        self._thread.start()
+
+    def stop_refresh(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        # Preloaded values may already be most of an interval old
+        loaded_at = self._loaded_at if self._loaded_at is not None else time.time()
+        delay = max(0.0, loaded_at + self.refresh_interval - time.time())
+        while not self._stop.wait(delay):
+            delay = self.refresh_interval
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the cached values; try again next interval
+                logger.exception("Secret refresh failed")
+
+
+def default_provider(names=APP_SECRETS):
+    """Provider configured from SECRETS_SOURCE / SECRETS_FILE / KEY_VAULT_URL."""
+    sources = [EnvSource()]
+    if SECRETS_FILE:
+        sources.append(FileSource(SECRETS_FILE))
+    if SECRETS_SOURCE == "keyvault":
+        sources.append(KeyVaultSource(KEY_VAULT_URL))
+    return SecretProvider(names, sources)
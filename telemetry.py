@@ -0,0 +1,228 @@
+"""Per-stage spans plus an in-process metrics registry rendered in Prometheus text format.
+
+Metrics are always recorded (a lock and a few additions per observation);
+spans follow the tracer provider's sampler, set from TRACE_SAMPLE_RATIO.
+Each worker process keeps its own registry, so under gunicorn a /metrics
+scrape reports the worker that served it.
+"""
+import asyncio
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+tracer = trace.get_tracer(__name__)
+
+
+def sampler():
+    return ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class CallbackCounter(Metric):
+    """A counter read from existing state at scrape time, e.g. cache hit/miss totals."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks = []
+
+    def watch(self, callback):
+        """``callback()`` returns {label tuple: value} and is called on every scrape."""
+        self._callbacks.append(callback)
+
+    def samples(self):
+        for callback in list(self._callbacks):
+            for key, value in callback().items():
+                yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_DURATION = registry.register(Histogram(
+    "farmer_http_request_duration_seconds", "Time to fully serve an HTTP request.", ("endpoint", "status")))
+STAGE_DURATION = registry.register(Histogram(
+    "farmer_stage_duration_seconds", "Time spent in each analysis stage, including cache lookups.", ("stage",)))
+UPSTREAM_DURATION = registry.register(Histogram(
+    "farmer_upstream_request_duration_seconds", "Latency of each upstream attempt.", ("stage", "outcome")))
+UPSTREAM_ERRORS = registry.register(Counter(
+    "farmer_upstream_errors_total", "Failed upstream attempts, by stage and error type.", ("stage", "error")))
+CACHE_REQUESTS = registry.register(CallbackCounter(
+    "farmer_cache_requests_total", "Cache lookups, by cache and result.", ("cache", "result")))
+OPENAI_TOKENS = registry.register(Counter(
+    "farmer_openai_tokens_total", "Azure OpenAI token usage.", ("kind",)))
+STARTUP_SECONDS = registry.register(Gauge(
+    "farmer_worker_startup_seconds", "Import-to-ready time of this worker.", ("phase",)))
+
+
+def watch_cache(name, cache):
+    CACHE_REQUESTS.watch(lambda: {(name, "hit"): cache.hits, (name, "miss"): cache.misses})
+
+
+def record_token_usage(usage):
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(usage.prompt_tokens, kind="prompt")
+    OPENAI_TOKENS.inc(usage.completion_tokens, kind="completion")
+
+
+@contextmanager
+def stage(name):
+    """Child span plus latency histogram for one analysis stage."""
+    started = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(name) as span:
+            yield span
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=name)
+
+
+@contextmanager
+def upstream_attempt(stage_name, attempt):
+    """Span, latency and error accounting for a single upstream attempt.
+
+    A cancelled attempt (client gone, shutdown) is timed as ``cancelled``, not
+    counted as an upstream error.
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        with tracer.start_as_current_span(f"upstream.{stage_name}", attributes={"retry.attempt": attempt}) as span:
+            yield span
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        outcome = "error"
+        UPSTREAM_ERRORS.inc(stage=stage_name, error=type(e).__name__)
+        raise
+    finally:
+        UPSTREAM_DURATION.observe(time.perf_counter() - started, stage=stage_name, outcome=outcome)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_DURATION.observe(time.perf_counter() - started,
+                                  endpoint=getattr(route, "path", "unmatched"), status=status)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+
+import httpx
+import openai
+
+from telemetry import upstream_attempt
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "50"))
+
+
+class UpstreamError(Exception):
+    """An upstream stage failed after exhausting its retry budget.
+
+    The message names only the stage and the cause's type: upstream errors can
+    carry request URLs, and the WeatherAPI key travels in the query string.
+    """
+
+    def __init__(self, stage, cause):
+        super().__init__(f"{stage} failed: {type(cause).__name__}")
+        self.stage = stage
+        self.cause = cause
+
+
+class RateLimited(Exception):
+    """The rate limiter's backlog is longer than a caller is allowed to wait."""
+
+
+class RateLimiter:
+    """Spaces calls to at most ``rate`` per second within this process.
+
+    Each ``acquire`` reserves the next free slot and sleeps until it; callers
+    whose slot is more than ``max_wait`` seconds away get RateLimited instead
+    of queueing indefinitely. Not thread-safe: use one instance per event loop.
+    Subclasses can keep the slots elsewhere by overriding ``_reserve``.
+    """
+
+    def __init__(self, rate, max_wait):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.max_wait = max_wait
+        self._next = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        delay = await self._reserve()
+        if delay is None:
+            raise RateLimited(f"no slot within {self.max_wait:.0f}s")
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _reserve(self):
+        """Reserves the next slot and returns the seconds until it, or None if it is too far away."""
+        now = time.monotonic()
+        slot = max(now, self._next)
+        if slot - now > self.max_wait:
+            return None
+        self._next = slot + self.interval
+        return slot - now
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    timeout: float
+    retries: int
+    backoff: float = 0.2
+
+    @classmethod
+    def from_env(cls, name, timeout, retries):
+        prefix = f"{name.upper()}_"
+        return cls(
+            name=name,
+            timeout=float(os.getenv(prefix + "TIMEOUT_SECONDS", timeout)),
+            retries=int(os.getenv(prefix + "RETRIES", retries)),
+        )
+
+
+# Per-stage budgets: each attempt gets ``timeout`` seconds, and up to
+# ``retries`` further attempts are made on transient failures.
+GEOCODE_STAGE = Stage.from_env("geocode", timeout=3.0, retries=1)
+FORECAST_STAGE = Stage.from_env("forecast", timeout=4.0, retries=2)
+ADVICE_STAGE = Stage.from_env("advice", timeout=30.0, retries=1)
+
+
+def create_http_client():
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        timeout=None,  # enforced per stage by call_with_retries
+    )
+
+
+def is_retryable(exc):
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+async def call_with_retries(stage, fn, limiter=None):
+    """Awaits ``fn()`` under the stage's timeout, retrying transient failures.
+
+    With a ``limiter``, every attempt (retries included) first waits for a slot;
+    that wait does not count against the stage timeout.
+    """
+    for attempt in range(stage.retries + 1):
+        if limiter is not None:
+            try:
+                await limiter.acquire()
+            except RateLimited as e:
+                raise UpstreamError(stage.name, e) from e
+        try:
+            with upstream_attempt(stage.name, attempt):
+                return await asyncio.wait_for(fn(), timeout=stage.timeout)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            if attempt == stage.retries:
+                raise UpstreamError(stage.name, e) from e
+        await asyncio.sleep(stage.backoff * 2 ** attempt)
+
+
+async def get_json(http, url, **kwargs):
+    response = await http.get(url, **kwargs)
+    if response.status_code == 429 or response.status_code >= 500:
+        # Not raise_for_status(): its message includes the full URL, API key and all
+        raise httpx.HTTPStatusError(
+            f"{response.status_code} from {response.request.url.copy_with(query=None)}",
+            request=response.request,
+            response=response,
+        )
+    return response.json()